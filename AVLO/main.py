@@ -1,14 +1,26 @@
-from common.dates import load_dates_inbetween, string_date_to_date_object, \
-    date_object_to_string_date
+from common.dates import date_object_to_string_date
+from common.config_cache import load_config
+from common.logs import configure_logging
 from AVLO.web_request import avlo_services_try
 from datetime import datetime
-import configparser
-from common.existing_output import load_services_to_request
-import random
+from common.existing_output import load_services_to_request, \
+    output_file_signature, update_existing_services_cache
 from common.remaining_time import print_remaining_time
 from common.write_missing_services import write_missing_services
-from os.path import dirname
+from os.path import dirname, join
+from common.webdriver_pool import init_webdriver_pool, quit_webdriver_pool, \
+    request_with_pooled_webdriver
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from threading import Lock
+import random
+import os
+import time
+import atexit
+import logging
+
 
+logger = logging.getLogger(__name__)
 
 AVLO_URL = r'https://avlorenfe.com/'
 
@@ -20,62 +32,113 @@ def main_function(config_file_path):
     and writes the resulting information in an output file.
     :param: config_file_path (str): path to the configuration file.
     """
-    # Load parameters from configuration file:
-    parser = configparser.ConfigParser()
-    parser.read(config_file_path)
+    # Log records are buffered and written periodically:
+    log_handler = configure_logging()
 
-    station_ods = [od.split('-')
-                   for od in parser.get("config", "station_ods").split(',')]
-    travel_dates = \
-        load_dates_inbetween(*parser.get("config", "travel_dates").split('-'))
-    chromedriver_path = parser.get("config", "chromedriver_path")
-    output_path = parser.get("config", "output_path")
-    show_window = parser.getboolean("config", "show_window")
+    # Load parameters from configuration file:
+    cfg = load_config(config_file_path)
 
     # Calculate today's date (DD/MM/YYYY):
-    search_date = date_object_to_string_date(datetime.now())
+    dt_now = datetime.now()
+    search_date = date_object_to_string_date(dt_now)
 
     # make sure that there are not dates to request prior to today:
-    assert string_date_to_date_object(travel_dates[0]) >= \
-        string_date_to_date_object(search_date), \
+    assert cfg.first_travel_date >= dt_now.date(), \
         'The specified start date is previous to today\'s date.'
 
     # Calculate train services to request (set argument repeat_services=False to
     # discard those that already exist in output file for the same search date):
-    services_to_request = load_services_to_request(station_ods, travel_dates,
-                                                   search_date, output_path)
+    services_to_request = load_services_to_request(cfg.station_ods,
+                                                   cfg.travel_dates,
+                                                   search_date, cfg.output_path)
     initial_remaining_services = len(services_to_request)
 
-    # Open output file
-    output_file = open(output_path, 'a')
-    start_dt = datetime.now()
-    last_services_not_found_count = 0
-    while len(services_to_request) > 0:
-        s_to_request = random.choice(services_to_request)
-        o_station, d_station, t_date, _ = s_to_request
-        # Request the train services for a specific origin and destination
-        # stations and date:
-        services_found = avlo_services_try(o_station, d_station, t_date,
-                                           output_file, chromedriver_path,
-                                           AVLO_URL, headless=not show_window)
-
-        if services_found:
-            services_to_request.remove(s_to_request)
-            print_remaining_time(start_dt, initial_remaining_services,
-                                 datetime.now(), len(services_to_request))
-            last_services_not_found_count = 0
-        else:
-            last_services_not_found_count += 1
-
-        if last_services_not_found_count > 20:
-            print('{}\tNo trains found for the following services: {}'
-                  .format(datetime.now(), services_to_request))
-            write_missing_services(services_to_request, 'AVLO',
-                                   dirname(output_path))
-            break
-
-    output_file.close()
-    print('{}\tFinished successfully!'.format(datetime.now()))
+    # Initialise a pool of Chrome Webdrivers once, so that they are reused for
+    # all the requests, which are launched concurrently (one per webdriver).
+    # Their Chrome profiles are kept next to the output file, so that the
+    # browser cache is reused between runs. The form field boxes are explicitly
+    # waited for, so there is no need to wait for the whole page to load:
+    drivers = init_webdriver_pool(cfg.chromedriver_path, cfg.num_webdrivers,
+                                  headless=not cfg.show_window,
+                                  page_load_strategy='eager',
+                                  profile_dir=join(dirname(cfg.output_path),
+                                                   '.chrome_profile_avlo'))
+    atexit.register(quit_webdriver_pool, drivers)
+
+    # Open output file (shared by all the threads, so writes are locked). It is
+    # written directly through its file descriptor, one write per request:
+    output_fd = os.open(cfg.output_path,
+                        os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    output_lock = Lock()
+    previous_output_signature = output_file_signature(cfg.output_path)
+    # services written in the output file, added by each request right after
+    # writing them (holding the output lock), so that none of them is missed
+    # if the run is stopped:
+    requested_services = set()
+    try:
+        start_monotonic = time.monotonic()
+        remaining_services = initial_remaining_services
+        last_services_not_found_count = 0
+        with ThreadPoolExecutor(max_workers=cfg.num_webdrivers) as executor:
+
+            def submit_request(service):
+                o_station, d_station, t_date, _ = service
+                # Request the train services for a specific origin and
+                # destination stations and date:
+                return executor.submit(request_with_pooled_webdriver, drivers,
+                                       avlo_services_try, o_station, d_station,
+                                       t_date, output_fd, output_lock,
+                                       requested_services,
+                                       AVLO_URL, headless=not cfg.show_window)
+
+            # services are requested in random order. They are shuffled only
+            # once, and at most one request per webdriver is launched at a
+            # time, so that an error stops the run without waiting for all
+            # the queued requests:
+            random.shuffle(services_to_request)
+            queued_services = deque(services_to_request)
+            pending = {}
+            while len(queued_services) > 0 or len(pending) > 0:
+                while len(queued_services) > 0 and \
+                        len(pending) < cfg.num_webdrivers:
+                    s_to_request = queued_services.popleft()
+                    pending[submit_request(s_to_request)] = s_to_request
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    s_to_request = pending.pop(future)
+                    if future.result():
+                        remaining_services -= 1
+                        print_remaining_time(start_monotonic,
+                                             initial_remaining_services,
+                                             remaining_services)
+                        last_services_not_found_count = 0
+                    else:
+                        # retry the service later on:
+                        last_services_not_found_count += 1
+                        queued_services.append(s_to_request)
+                log_handler.flush()
+
+                if last_services_not_found_count > 20:
+                    wait(pending)
+                    missing_services = [s for f, s in pending.items()
+                                        if not f.result()]
+                    missing_services.extend(queued_services)
+                    logger.error('No trains found for the following '
+                                 'services: %s', missing_services)
+                    write_missing_services(missing_services, 'AVLO',
+                                           dirname(cfg.output_path))
+                    break
+    finally:
+        os.close(output_fd)
+        quit_webdriver_pool(drivers)
+        # add the services written during this run to the existing services
+        # cache, so that the output file does not need to be parsed again:
+        update_existing_services_cache(cfg.output_path,
+                                       previous_output_signature,
+                                       requested_services)
+
+    logger.info('Finished successfully!')
+    log_handler.flush()
 
 
 if __name__ == '__main__':
@@ -1,85 +1,131 @@
-from selenium import webdriver
-from selenium.webdriver.common.keys import Keys
-import time
 from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from datetime import datetime
-from selenium.webdriver.chrome.options import Options
 from selenium.common.exceptions import TimeoutException, \
     NoSuchElementException, UnexpectedAlertPresentException, \
-    ElementNotInteractableException, WebDriverException
+    ElementNotInteractableException, JavascriptException
 from common.dates import date_object_to_string_date
+from common.existing_output import OUTPUT_FILE_ENCODING, TrainService
+import os
+import logging
+import time
 
 
-def avlo_services_try(origin_station, destination_station, travel_date,
-                      output_file, chromedriver_path, avlo_url, headless=True):
+logger = logging.getLogger(__name__)
+
+# Script filling in the date field box (firing the events that the website
+# listens to) and submitting the search form as if the search button was
+# pressed (running the submit handlers of the page):
+FILL_DATE_AND_SUBMIT_SCRIPT = """
+    const date = document.querySelector("[name='estacionOrigen.fecha']");
+    date.value = arguments[0];
+    date.dispatchEvent(new Event('input', {bubbles: true}));
+    date.dispatchEvent(new Event('change', {bubbles: true}));
+    document.querySelector(".border-color-orange").closest('form')
+        .requestSubmit();
+"""
+
+# Script returning the non-empty lines of text of each train service shown in
+# the results table:
+READ_RESULTS_SCRIPT = """
+    return Array.from(
+        document.querySelectorAll('#listaTrenesTBody .contHistorial'))
+        .map(element => element.innerText.split('\\n').filter(line => line));
+"""
+
+
+def avlo_services_try(driver, origin_station, destination_station,
+                      travel_date, output_fd, output_lock, written_services,
+                      avlo_url, headless=True, retries=3, backoff=2.0):
     """
     Launches the "avlo_services" function for a specific origin and destination
     pair of stations and for a specific date. If the process raises a
     "TimeoutException" or "NoSuchElementException" type exception, then it
-    escapes it and returns False. If the process does complete without errors,
-    then True boolean value is returned.
+    escapes it and launches the process again with the same webdriver, waiting
+    longer before each new attempt. If all the attempts fail, then it returns
+    False. If the process does complete without errors, then True boolean
+    value is returned. Other webdriver errors (the webdriver has stopped
+    working) are raised, so that the webdriver can be replaced.
+    :param driver: (Chrome Webdriver) already initialised webdriver, reused
+        between requests.
     :param origin_station: (string) origin station to request.
     :param destination_station: (string) destination station to request.
     :param travel_date: (string DD/MM/YYYY) date to request.
-    :param output_file: (file object) file to which the output information will
-        be written.
-    :param chromedriver_path: (string) path to the chromedriver exe file.
+    :param output_fd: (integer) file descriptor of the output file (opened in
+        append mode), to which the output information will be written.
+    :param output_lock: (Lock) lock that must be acquired to write in the
+        output file, which may be shared by several threads.
+    :param written_services: (set of tuples {(str,str,str,str)}) train
+        services written in the output file (origin station, destination
+        station, travel date and search date), to which the requested service
+        is added once written. It is only modified holding output_lock.
     :param avlo_url: (string) URL path to the AVLO website.
     :param headless: (boolean) if False, the browser window will be shown. Set
         as True for speed.
+    :param retries: (integer) maximum number of attempts.
+    :param backoff: (float) base of the exponential waiting time (seconds)
+        before each new attempt.
     :return boolean. True if train services have been found. False otherwise.
     """
-    try:
-        avlo_services(origin_station, destination_station, travel_date,
-                      output_file, chromedriver_path, avlo_url,
-                      headless=headless)
-        return True        
-    except (TimeoutException, NoSuchElementException,
-            UnexpectedAlertPresentException, ElementNotInteractableException,
-            WebDriverException, IndexError) as _error:
-        return False
-
-
-def avlo_services(origin_station, destination_station, travel_date,
-                  output_file,  chromedriver_path, avlo_url,
+    for attempt in range(retries):
+        try:
+            avlo_services(driver, origin_station, destination_station,
+                          travel_date, output_fd, output_lock,
+                          written_services, avlo_url, headless=headless)
+            return True
+        except (TimeoutException, NoSuchElementException,
+                UnexpectedAlertPresentException,
+                ElementNotInteractableException,
+                JavascriptException, IndexError) as _error:
+            if attempt < retries - 1:
+                time.sleep(backoff ** attempt)
+    return False
+
+
+def avlo_services(driver, origin_station, destination_station, travel_date,
+                  output_fd, output_lock, written_services, avlo_url,
                   loading_wait_seconds=10, headless=True):
     """
-    Initialises and executes the Chrome Webdriver. Uses it to retrieve the AVLO
-    website. Fills in the required information in the AVLO website for the
-    specified origin station, destination station and date. Then loads the
-    results page and reads the existing train services for that date, with
-    their departure and arrival times and prices. Writes this information to
-    an output file and closes the Webdriver.
+    Uses the provided Chrome Webdriver to retrieve the AVLO website. Fills in
+    the required information in the AVLO website for the specified origin
+    station, destination station and date. Then loads the results page and
+    reads the existing train services for that date, with their departure and
+    arrival times and prices. Writes this information to an output file and
+    clears the Webdriver cookies, so that it can be reused for the next
+    request.
+    :param driver: (Chrome Webdriver) already initialised webdriver, reused
+        between requests.
     :param origin_station: (string) origin station to request.
     :param destination_station: (string) destination station to request.
     :param travel_date: (string DD/MM/YYYY) date to request.
-    :param output_file: (file object) file to which the output information will
-        be written.
-    :param chromedriver_path: (string) path to the chromedriver exe file.
+    :param output_fd: (integer) file descriptor of the output file (opened in
+        append mode), to which the output information will be written.
+    :param output_lock: (Lock) lock that must be acquired to write in the
+        output file, which may be shared by several threads.
+    :param written_services: (set of tuples {(str,str,str,str)}) train
+        services written in the output file (origin station, destination
+        station, travel date and search date), to which the requested service
+        is added once written. It is only modified holding output_lock.
     :param avlo_url: (string) URL path to the AVLO website.
-    :param loading_wait_seconds: (float)
+    :param loading_wait_seconds: (float) maximum number of seconds to wait
+        for the website elements to load.
     :param headless: (boolean) if False, the browser window will be shown. Set
         as True for speed.
     """
     # Obtain current date and time:
     dt_now = datetime.now()
     search_date = date_object_to_string_date(dt_now)
-    search_time = str(dt_now.hour).zfill(2) + ':' + str(dt_now.minute).zfill(2)
-    print('{}\tSearching for \"{}\" -> \"{}\" services for date: {} in AVLO'
-          .format(datetime.now(), origin_station, destination_station,
-                  travel_date))
-
-    # Enter site:
-    options = Options()
-    if headless:
-        options.add_argument("--headless")  # to not see browser window
-    driver = webdriver.Chrome(chromedriver_path, options=options)
+    search_time = dt_now.strftime('%H:%M')
+    logger.info('Searching for "%s" -> "%s" services for date: %s in AVLO',
+                origin_station, destination_station, travel_date)
+
+    # Enter site (the webdriver is reused, so the page is loaded again instead
+    # of launching a new browser):
     driver.get(avlo_url)
     webpage_title = driver.title
-    print('{}\tEntered \"{}\" site successfully'.format(datetime.now(),
-                                                        webpage_title))
+    logger.info('Entered "%s" site successfully', webpage_title)
 
     # Wait for the website to load the origin station field box:
     search = WebDriverWait(driver, loading_wait_seconds).until(
@@ -95,7 +141,7 @@ def avlo_services(origin_station, destination_station, travel_date,
 
     # Fill in the origin station field box:
     search.send_keys(origin_station)
-    time.sleep(1.5)  # wait for the dropdown options to show TODO: esperar hasta que cargue
+    time.sleep(1.5)  # wait for the dropdown options to show
     search.send_keys(Keys.TAB)
     # by pressing the TAB button, the field autocompletes
 
@@ -108,49 +154,47 @@ def avlo_services(origin_station, destination_station, travel_date,
     search.send_keys(Keys.TAB)
     # by pressing the TAB button, the field autocompletes
 
-    # Search for the date field box:
-    search = driver.find_element_by_name("estacionOrigen.fecha")
-    search.send_keys(travel_date)
+    # Fill in the date field box and submit the form in a single webdriver
+    # call:
+    driver.execute_script(FILL_DATE_AND_SUBMIT_SCRIPT, travel_date)
 
-    # TODO: buscar forma mas elegante de hacer esto:
-    search = driver.find_element_by_class_name("border-color-orange")
-    search.send_keys(Keys.TAB)
-    search.send_keys(Keys.TAB)
-    search.send_keys(Keys.TAB)
-    search.send_keys(Keys.TAB)
-    search.send_keys(Keys.RETURN)
-
-    print('{}\tFilled in field boxes successfully. Waiting for response...'
-          .format(datetime.now()))
+    logger.info('Filled in field boxes successfully. Waiting for response...')
 
-    # TODO: cambiar lo de loading_wait_seconds por load como arriba
-    time.sleep(loading_wait_seconds)
-    search = driver.find_element_by_id("listaTrenesTBody")
-    # print( search.text )
+    # Wait for the results table to load the train services:
+    WebDriverWait(driver, loading_wait_seconds).until(
+        EC.presence_of_element_located((By.CSS_SELECTOR,
+                                        "#listaTrenesTBody .contHistorial")))
 
-    services = driver.find_elements_by_class_name("contHistorial")
+    # Read the lines of text of all the train services in a single webdriver
+    # call:
+    services = driver.execute_script(READ_RESULTS_SCRIPT)
     parsed_train_services = []
-    for service in services:
-        service_info_list = service.text.split('\n')
-        if service_info_list == ['']:
+    for service_info_list in services:
+        if len(service_info_list) == 0:
             continue
         departure_time = service_info_list[0]
         arrival_time = service_info_list[1]
         price = service_info_list[-1]  # TODO: comprobar que es un precio, bug -> raise Time...Error
-        train_service = [origin_station, destination_station, travel_date,
-                         departure_time, arrival_time, price, 'AVLO',
-                         search_date, search_time]
+        train_service = TrainService(origin_station, destination_station,
+                                     travel_date, departure_time,
+                                     arrival_time, price, 'AVLO', search_date,
+                                     search_time)
         parsed_train_services.append(train_service)
 
-    driver.quit()
+    driver.delete_all_cookies()
 
     if len(parsed_train_services) == 0:
         raise TimeoutException
 
-    for train_service in parsed_train_services:
-        output_file.write('|'.join(train_service) + '\n')
-
-    print('{}\t{} train services found ({} - {}, {}) and written in output file'
-          .format(datetime.now(), len(parsed_train_services),
-                  origin_station, destination_station, travel_date))
+    # Write all the train services at once (a single system call):
+    payload = ''.join('|'.join(train_service) + '\n'
+                      for train_service in parsed_train_services)
+    with output_lock:
+        os.write(output_fd, payload.encode(OUTPUT_FILE_ENCODING))
+        written_services.add((origin_station, destination_station,
+                              travel_date, search_date))
+
+    logger.info('%s train services found (%s - %s, %s) and written in output '
+                'file', len(parsed_train_services), origin_station,
+                destination_station, travel_date)
 
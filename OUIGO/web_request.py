@@ -1,62 +1,104 @@
-from selenium import webdriver
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
 from datetime import datetime
-from selenium.webdriver.chrome.options import Options
 from selenium.common.exceptions import TimeoutException, \
     NoSuchElementException, UnexpectedAlertPresentException, \
-    ElementNotInteractableException
-import time
+    ElementNotInteractableException, JavascriptException
 from common.dates import date_object_to_string_date
+from common.existing_output import OUTPUT_FILE_ENCODING, TrainService
+import os
+import logging
+import time
+
+
+logger = logging.getLogger(__name__)
+
 
+# Script returning the texts of the departure times, arrival times and prices
+# of the train services shown in the results page:
+READ_RESULTS_SCRIPT = """
+    const texts = (selector) => Array.from(document.querySelectorAll(selector))
+        .map(element => element.innerText.trim());
+    return [texts('div[class="sc-krtoiy Jyeze"]'),
+            texts('div[class="sc-lcwbcE gmUBgo"]'),
+            texts('div[class="sc-gEUNXV iLVHbv"]')];
+"""
 
-def ouigo_services_try(origin_station, destination_station, travel_date,
-                       output_file,  chromedriver_path, ouigo_url,
-                       headless=True):
+
+def ouigo_services_try(driver, origin_station, destination_station,
+                       travel_date, output_fd, output_lock, written_services,
+                       ouigo_url, headless=True, retries=3, backoff=2.0):
     """
     Launches the "ouigo_services" function for a specific origin and destination
     pair of stations and for a specific date. If the process raises a
     "TimeoutException" or "NoSuchElementException" type exception, then it
-    escapes it and returns False. If the process does complete without errors,
-    then True boolean value is returned.
+    escapes it and launches the process again with the same webdriver, waiting
+    longer before each new attempt. If all the attempts fail, then it returns
+    False. If the process does complete without errors, then True boolean
+    value is returned. Other webdriver errors (the webdriver has stopped
+    working) are raised, so that the webdriver can be replaced.
+    :param driver: (Chrome Webdriver) already initialised webdriver, reused
+        between requests.
     :param origin_station: (string) origin station to request.
     :param destination_station: (string) destination station to request.
     :param travel_date: (string DD/MM/YYYY) date to request.
-    :param output_file: (file object) file to which the output information will
-        be written.
-    :param chromedriver_path: (string) path to the chromedriver exe file.
+    :param output_fd: (integer) file descriptor of the output file (opened in
+        append mode), to which the output information will be written.
+    :param output_lock: (Lock) lock that must be acquired to write in the
+        output file, which may be shared by several threads.
+    :param written_services: (set of tuples {(str,str,str,str)}) train
+        services written in the output file (origin station, destination
+        station, travel date and search date), to which the requested service
+        is added once written. It is only modified holding output_lock.
     :param ouigo_url: (string) URL path to the OUIGO website.
     :param headless: (boolean) if False, the browser window will be shown. Set
         as True for speed.
+    :param retries: (integer) maximum number of attempts.
+    :param backoff: (float) base of the exponential waiting time (seconds)
+        before each new attempt.
     :return boolean. True if train services have been found. False otherwise.
     """
-    try:
-        ouigo_services(origin_station, destination_station, travel_date,
-                       output_file, chromedriver_path, ouigo_url,
-                       headless=headless)
-        return True
+    for attempt in range(retries):
+        try:
+            ouigo_services(driver, origin_station, destination_station,
+                           travel_date, output_fd, output_lock,
+                           written_services, ouigo_url, headless=headless)
+            return True
+        except (TimeoutException, NoSuchElementException,
+                UnexpectedAlertPresentException,
+                ElementNotInteractableException,
+                JavascriptException) as _error:
+            if attempt < retries - 1:
+                time.sleep(backoff ** attempt)
+    return False
 
-    except (TimeoutException, NoSuchElementException,
-            UnexpectedAlertPresentException, ElementNotInteractableException) \
-            as _error:
-        return False
 
-
-def ouigo_services(origin_station, destination_station, travel_date,
-                   output_file, chromedriver_path, ouigo_url, headless=True):
+def ouigo_services(driver, origin_station, destination_station, travel_date,
+                   output_fd, output_lock, written_services, ouigo_url,
+                   headless=True):
     """
-    Initialises and executes the Chrome Webdriver. Uses it to retrieve the OUIGO
-    website. Fills in the required information in the OUIGO website for the
-    specified origin station, destination station and date. Then loads the
-    results page and reads the existing train services for that date, with
-    their departure and arrival times and prices. Writes this information in
-    an output file and closes the Webdriver.
+    Uses the provided Chrome Webdriver to retrieve the OUIGO website. Fills in
+    the required information in the OUIGO website for the specified origin
+    station, destination station and date. Then loads the results page and
+    reads the existing train services for that date, with their departure and
+    arrival times and prices. Writes this information in an output file and
+    clears the Webdriver cookies, so that it can be reused for the next
+    request.
+    :param driver: (Chrome Webdriver) already initialised webdriver, reused
+        between requests.
     :param origin_station: (string) origin station to request.
     :param destination_station: (string) destination station to request.
     :param travel_date: (string DD/MM/YYYY) date to request.
-    :param output_file: (file object) file to which the output information will
-        be written.
-    :param chromedriver_path: (string) path to the chromedriver exe file.
+    :param output_fd: (integer) file descriptor of the output file (opened in
+        append mode), to which the output information will be written.
+    :param output_lock: (Lock) lock that must be acquired to write in the
+        output file, which may be shared by several threads.
+    :param written_services: (set of tuples {(str,str,str,str)}) train
+        services written in the output file (origin station, destination
+        station, travel date and search date), to which the requested service
+        is added once written. It is only modified holding output_lock.
     :param ouigo_url: (string) URL path to the OUIGO website.
     :param headless: (boolean) if False, the browser window will be shown. Set
         as True for speed.
@@ -64,20 +106,15 @@ def ouigo_services(origin_station, destination_station, travel_date,
     # Obtain current date and time:
     dt_now = datetime.now()
     search_date = date_object_to_string_date(dt_now)
-    search_time = str(dt_now.hour).zfill(2) + ':' + str(dt_now.minute).zfill(2)
-    print('{}\tSearching for \"{}\" -> \"{}\" services for date: {} in OUIGO'
-          .format(datetime.now(), origin_station, destination_station,
-                  travel_date))
+    search_time = dt_now.strftime('%H:%M')
+    logger.info('Searching for "%s" -> "%s" services for date: %s in OUIGO',
+                origin_station, destination_station, travel_date)
 
-    # Enter site:
-    options = Options()
-    if headless:
-        options.add_argument("--headless")  # to not see browser window
-    driver = webdriver.Chrome(chromedriver_path, options=options)
+    # Enter site (the webdriver is reused, so the page is loaded again instead
+    # of launching a new browser):
     driver.get(ouigo_url)
     webpage_title = driver.title
-    print('{}\tEntered \"{}\" site successfully'.format(datetime.now(),
-                                                        webpage_title))
+    logger.info('Entered "%s" site successfully', webpage_title)
 
     # accept all cookies (not strictly necessary, but helps visually when
     # displaying window - not headless):
@@ -180,61 +217,57 @@ def ouigo_services(origin_station, destination_station, travel_date,
         "//button[@id='search_submit']")
     search_button.click()
 
-    print('{}\tFilled in field boxes successfully. Waiting for response...'
-          .format(datetime.now()))
+    logger.info('Filled in field boxes successfully. Waiting for response...')
 
-    time.sleep(2)
+    # Wait for the results page to load the train services:
+    WebDriverWait(driver, 10).until(EC.presence_of_element_located(
+        (By.XPATH, "//div[@class='sc-krtoiy Jyeze']")))
 
-    # Reach information from each train service for this date:
-    # departure times:
-    departure_times = driver.find_elements_by_xpath(
-        "//div[@class='sc-krtoiy Jyeze']")
-    # arrival times:
-    arrival_times = driver.find_elements_by_xpath(
-        "//div[@class='sc-lcwbcE gmUBgo']")
-    # prices:
-    prices = driver.find_elements_by_xpath(
-        "//div[@class='sc-gEUNXV iLVHbv']")
+    # Reach information from each train service for this date (departure
+    # times, arrival times and prices), all of it in a single webdriver call:
+    departure_times, arrival_times, prices = driver.execute_script(
+        READ_RESULTS_SCRIPT)
 
     # make sure the information is consistent. If not, raise exception that
     # makes the process retry:
 
     if not (len(departure_times) == len(arrival_times) == len(prices)):
-        print('{}\tInconsistent results for ({} - {}, {}). Skipped.'
-              .format(datetime.now(), origin_station, destination_station,
-                      travel_date))
+        logger.info('Inconsistent results for (%s - %s, %s). Skipped.',
+                    origin_station, destination_station, travel_date)
         raise TimeoutException
     elif len(departure_times) == 0:
-        print('{}\tNo results found for ({} - {}, {}). Skipped.'
-              .format(datetime.now(), origin_station, destination_station,
-                      travel_date))
+        logger.info('No results found for (%s - %s, %s). Skipped.',
+                    origin_station, destination_station, travel_date)
         raise TimeoutException
 
     parsed_train_services = []
-    for trip_index in range(len(departure_times)):
-        dep_time = departure_times[trip_index].text
-        arr_time = arrival_times[trip_index].text
-        price = prices[trip_index].text
+    for dep_time, arr_time, price in zip(departure_times, arrival_times,
+                                         prices):
         if price.lower().rstrip() == 'tren completo':
             pass
         else:
             try:
                 float(price.replace(',', '.').replace('€', ''))
             except ValueError:
-                print('{}\t"{}" invalid price value ({} - {}, {}). Skipped.'
-                      .format(datetime.now(), price, origin_station,
-                              destination_station, travel_date))
+                logger.info('"%s" invalid price value (%s - %s, %s). Skipped.',
+                            price, origin_station, destination_station,
+                            travel_date)
                 raise TimeoutException
-        train_service = [origin_station, destination_station, travel_date,
-                         dep_time, arr_time, price, 'OUIGO', search_date,
-                         search_time]
+        train_service = TrainService(origin_station, destination_station,
+                                     travel_date, dep_time, arr_time, price,
+                                     'OUIGO', search_date, search_time)
         parsed_train_services.append(train_service)
 
-    driver.quit()
+    driver.delete_all_cookies()
 
-    for train_service in parsed_train_services:
-        output_file.write('|'.join(train_service) + '\n')
+    # Write all the train services at once (a single system call):
+    payload = ''.join('|'.join(train_service) + '\n'
+                      for train_service in parsed_train_services)
+    with output_lock:
+        os.write(output_fd, payload.encode(OUTPUT_FILE_ENCODING))
+        written_services.add((origin_station, destination_station,
+                              travel_date, search_date))
 
-    print('{}\t{} train services found ({} - {}, {}) and written in output file'
-          .format(datetime.now(), len(parsed_train_services),
-                  origin_station, destination_station, travel_date))
+    logger.info('%s train services found (%s - %s, %s) and written in output '
+                'file', len(parsed_train_services), origin_station,
+                destination_station, travel_date)
@@ -0,0 +1,55 @@
+from collections import namedtuple
+from configparser import ConfigParser
+from os.path import getmtime
+from common.dates import load_dates_inbetween, string_date_to_date_object
+
+
+# Parameters of the configuration file of the scrapers, already converted to
+# their types:
+ScraperConfig = namedtuple('ScraperConfig',
+                           ['station_ods', 'travel_dates', 'first_travel_date',
+                            'chromedriver_path', 'output_path', 'show_window',
+                            'num_webdrivers'])
+
+# Already loaded configuration files, {path -> (modification time, config)}:
+_CACHE = {}
+
+
+def load_config(config_file_path):
+    """
+    Loads the parameters of a scraper configuration file. The parsed parameters
+    are kept in memory, so that the file is only parsed again if it has been
+    modified since the last time it was loaded.
+    :param config_file_path: (string) path to the configuration file.
+    :return: config: (ScraperConfig) with the following fields:
+        station_ods: (tuple of tuples ((str,str),...)) origin and destination
+            stations to request.
+        travel_dates: (tuple of strings ("DD/MM/YYYY",...)) dates to request.
+        first_travel_date: (date object) first date to request.
+        chromedriver_path: (string) path to the chromedriver exe file.
+        output_path: (string) path to the output file.
+        show_window: (boolean) if True, the browser windows will be shown.
+        num_webdrivers: (integer) number of webdrivers requesting services
+            concurrently.
+    """
+    mtime = getmtime(config_file_path)
+    cached = _CACHE.get(config_file_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    parser = ConfigParser()
+    parser.read(config_file_path)
+
+    travel_date_boundaries = parser.get("config", "travel_dates").split('-')
+    config = ScraperConfig(
+        station_ods=tuple(tuple(od.split('-')) for od in
+                          parser.get("config", "station_ods").split(',')),
+        travel_dates=tuple(load_dates_inbetween(*travel_date_boundaries)),
+        first_travel_date=string_date_to_date_object(travel_date_boundaries[0]),
+        chromedriver_path=parser.get("config", "chromedriver_path"),
+        output_path=parser.get("config", "output_path"),
+        show_window=parser.getboolean("config", "show_window"),
+        num_webdrivers=parser.getint("config", "num_webdrivers", fallback=3))
+
+    _CACHE[config_file_path] = (mtime, config)
+    return config
@@ -21,10 +21,7 @@ def date_object_to_string_date(date_object):
     :param: date_object: (date object)
     :return: string_date: (string "DD/MM/YYYY")
     """
-    string_date = str(date_object.day).zfill(2) + '/' + \
-        str(date_object.month).zfill(2) + '/' + \
-        str(date_object.year)
-
+    string_date = date_object.strftime('%d/%m/%Y')
     return string_date
 
 
@@ -41,14 +38,10 @@ def load_dates_inbetween(first_date, last_date):
 
     assert first_date_object <= last_date_object
 
-    inbetween_dates = []
-    current_date_object = first_date_object
-    while current_date_object <= last_date_object:
-        current_date = str(current_date_object.day).zfill(2) + '/' + \
-            str(current_date_object.month).zfill(2) + '/' + \
-            str(current_date_object.year)
-        inbetween_dates.append(current_date)
-        current_date_object += timedelta(days=1)
+    num_days = (last_date_object - first_date_object).days + 1
+    inbetween_dates = [
+        (first_date_object + timedelta(days=i)).strftime('%d/%m/%Y')
+        for i in range(num_days)]
 
     return inbetween_dates
 
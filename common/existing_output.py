@@ -1,6 +1,37 @@
-from csv import DictReader
+from collections import namedtuple
+from os import stat, replace
 from os.path import exists
-from datetime import datetime
+import pickle
+from itertools import product, filterfalse
+from locale import getpreferredencoding
+from hashlib import blake2b
+from math import ceil, log
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# Encoding of the output file, which is written in binary mode by the scrapers
+# (same encoding that was used when writing it in text mode):
+OUTPUT_FILE_ENCODING = getpreferredencoding(False)
+
+# Train service record, as written in each line of the output file (its fields
+# are the columns of the output file, in order):
+TrainService = namedtuple('TrainService',
+                          ['origin_station', 'destination_station',
+                           'travel_date', 'departure_time', 'arrival_time',
+                           'price', 'company', 'search_date', 'search_time'])
+
+# Suffixes of the cache files kept next to the output file:
+EXISTING_CACHE_SUFFIX = '.cache.pkl'
+BLOOM_CACHE_SUFFIX = '.bloom.pkl'
+
+# False positive rate of the bloom filter of already requested services:
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+
+# Already requested train services loaded during the current run, together
+# with the output file signature when they were loaded, for each output file:
+_LOADED_EXISTING = {}
 
 
 def initialize_output_file(output_path):
@@ -9,12 +40,229 @@ def initialize_output_file(output_path):
     :param output_path: (string) path to where the output file will be created.
     """
     output_file = open(output_path, 'w')
-    output_file.write('origin_station|destination_station|travel_date|' +
-                      'departure_time|arrival_time|price|company|' +
-                      'search_date|search_time\n')
+    output_file.write('|'.join(TrainService._fields) + '\n')
     output_file.close()
 
 
+def output_file_signature(output_path):
+    """
+    Obtains the modification time and size of the output file, which are used
+    to check whether a cache of the output file is still valid.
+    :param output_path: (string) path to the existing output file.
+    :return: (tuple (float, int)) modification time and size of the file.
+    """
+    output_stat = stat(output_path)
+    return output_stat.st_mtime, output_stat.st_size
+
+
+def _parse_existing(output_path):
+    """
+    Reads the output file and extracts the train services for which there is
+    already existing information in it.
+    :param output_path: (string) path to the existing output file.
+    :return: existing_requested_services: set of tuples {(str,str,str,str)},
+        each tuple containing the origin station, destination station, travel
+        date and search date of an already requested train service.
+    """
+    with open(output_path, 'r', buffering=1 << 20) as output_file:
+        header = output_file.readline().rstrip('\n').split('|')
+        i_o, i_d, i_t, i_s = (header.index(column) for column in
+                              ('origin_station', 'destination_station',
+                               'travel_date', 'search_date'))
+        # malformed lines, without all the columns, are skipped:
+        min_num_fields = max(i_o, i_d, i_t, i_s) + 1
+        existing_requested_services = {
+            (line[i_o], line[i_d], line[i_t], line[i_s])
+            for line in (raw_line.rstrip('\n').split('|')
+                         for raw_line in output_file)
+            if len(line) >= min_num_fields}
+    return existing_requested_services
+
+
+def _bloom_positions(service, num_bits, num_hashes):
+    """
+    Calculates the bits of the bloom filter corresponding to a train service
+    (double hashing of a single 128-bit hash).
+    :param service: (tuple (str,str,str,str)) train service.
+    :param num_bits: (integer) number of bits of the bloom filter.
+    :param num_hashes: (integer) number of bits set per train service.
+    :return: (generator of integers) positions of the bits.
+    """
+    digest = blake2b('|'.join(service).encode(), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    return ((h1 + i * h2) % num_bits for i in range(num_hashes))
+
+
+def build_bloom(existing_requested_services):
+    """
+    Builds a bloom filter of the already requested train services, which
+    is much smaller than the set of services itself. It may state that a
+    service exists when it does not (false positive), but never the opposite.
+    :param existing_requested_services: set of tuples {(str,str,str,str)}.
+    :return: bloom: (tuple (int, bytearray)) number of hashes per service and
+        bits of the bloom filter.
+    """
+    num_services = max(len(existing_requested_services), 1)
+    num_bits = ceil(-num_services * log(BLOOM_FALSE_POSITIVE_RATE) /
+                    log(2) ** 2)
+    num_bits = max(8 * ceil(num_bits / 8), 8)
+    num_hashes = max(round(num_bits / num_services * log(2)), 1)
+    bloom = (num_hashes, bytearray(num_bits // 8))
+    add_to_bloom(bloom, existing_requested_services)
+    return bloom
+
+
+def add_to_bloom(bloom, services):
+    """
+    Adds train services to a bloom filter, in place. The false positive rate
+    grows if many more services than those it was built for are added, until
+    it is built again.
+    :param bloom: (tuple (int, bytearray)) bloom filter (see "build_bloom").
+    :param services: iterable of tuples [(str,str,str,str)].
+    """
+    num_hashes, bits = bloom
+    num_bits = len(bits) * 8
+    for service in services:
+        for position in _bloom_positions(service, num_bits, num_hashes):
+            bits[position >> 3] |= 1 << (position & 7)
+
+
+def bloom_contains(bloom, service):
+    """
+    Checks whether a train service may be in the bloom filter.
+    :param bloom: (tuple (int, bytearray)) bloom filter (see "build_bloom").
+    :param service: (tuple (str,str,str,str)) train service.
+    :return: (boolean) False if the service is surely not in the filter, True
+        if it may be.
+    """
+    num_hashes, bits = bloom
+    return all(bits[position >> 3] & (1 << (position & 7))
+               for position in _bloom_positions(service, len(bits) * 8,
+                                                num_hashes))
+
+
+def _read_cache_file(cache_path):
+    """
+    Reads a cache file of the output file. A cache file that cannot be read
+    (for example, truncated if its writing was interrupted) is treated as if
+    it did not exist.
+    :param cache_path: (string) path to the cache file.
+    :return: (tuple (tuple (float, int), content)) signature of the output
+        file when the cache was written and cached content, or None if there
+        is no readable cache file.
+    """
+    if not exists(cache_path):
+        return None
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            signature, content = pickle.load(cache_file)
+    except (EOFError, pickle.UnpicklingError, ValueError):
+        return None
+    return signature, content
+
+
+def _dump_cache_file(cache_path, signature, content):
+    """
+    Writes a cache file of the output file. It is written in a temporary file
+    which then replaces the cache file, so that an interrupted writing never
+    leaves a truncated cache file.
+    :param cache_path: (string) path to the cache file.
+    :param signature: (tuple (float, int)) signature of the output file.
+    :param content: content to cache.
+    """
+    temporary_path = cache_path + '.tmp'
+    with open(temporary_path, 'wb') as cache_file:
+        pickle.dump((signature, content), cache_file)
+    replace(temporary_path, cache_path)
+
+
+def _load_cache_file(cache_path, output_path):
+    """
+    Loads the content of a cache file of the output file, if it exists and it
+    is up to date with the output file.
+    :param cache_path: (string) path to the cache file.
+    :param output_path: (string) path to the existing output file.
+    :return: the cached content, or None if there is no valid cache.
+    """
+    cache = _read_cache_file(cache_path)
+    if cache is None or cache[0] != output_file_signature(output_path):
+        return None
+    return cache[1]
+
+
+def _write_cached_existing(output_path, signature,
+                           existing_requested_services):
+    """
+    Writes the already requested train services and their bloom filter in
+    cache files next to the output file, together with the output file
+    signature.
+    :param output_path: (string) path to the existing output file.
+    :param signature: (tuple (float, int)) signature of the output file.
+    :param existing_requested_services: set of tuples {(str,str,str,str)}.
+    """
+    _dump_cache_file(output_path + EXISTING_CACHE_SUFFIX, signature,
+                     existing_requested_services)
+    _dump_cache_file(output_path + BLOOM_CACHE_SUFFIX, signature,
+                     build_bloom(existing_requested_services))
+
+
+def _load_cached_existing(output_path):
+    """
+    Loads the train services for which there is already existing information
+    in the output file. If the cache file is up to date with the output file,
+    the services are loaded from it. Otherwise, the output file is parsed and
+    the cache files are rewritten. The loaded services are kept, so that they
+    can be updated at the end of the run without loading them again.
+    :param output_path: (string) path to the existing output file.
+    :return: existing_requested_services: set of tuples {(str,str,str,str)}.
+    """
+    signature = output_file_signature(output_path)
+    existing_requested_services = _load_cache_file(
+        output_path + EXISTING_CACHE_SUFFIX, output_path)
+    if existing_requested_services is None:
+        existing_requested_services = _parse_existing(output_path)
+        _write_cached_existing(output_path, signature,
+                               existing_requested_services)
+
+    _LOADED_EXISTING[output_path] = (signature, existing_requested_services)
+    return existing_requested_services
+
+
+def update_existing_services_cache(output_path, previous_signature,
+                                   new_requested_services):
+    """
+    Adds the train services that have been written in the output file during
+    the current run to the cache files, so that the output file does not need
+    to be parsed again. The bits of the new services are set in the bloom
+    filter, and the set of services is only updated if it was loaded during
+    the run (otherwise it is left out of date, and it will be rebuilt the next
+    time it is needed). Cache files that were not up to date with the output
+    file before the run are left as they are.
+    :param output_path: (string) path to the existing output file.
+    :param previous_signature: (tuple (float, int)) signature of the output
+        file before writing in it.
+    :param new_requested_services: iterable of tuples [(str,str,str,str)] with
+        the origin station, destination station, travel date and search date
+        of the train services written during the run.
+    """
+    signature = output_file_signature(output_path)
+
+    bloom_path = output_path + BLOOM_CACHE_SUFFIX
+    cache = _read_cache_file(bloom_path)
+    if cache is not None and cache[0] == previous_signature:
+        bloom = cache[1]
+        add_to_bloom(bloom, new_requested_services)
+        _dump_cache_file(bloom_path, signature, bloom)
+
+    loaded = _LOADED_EXISTING.pop(output_path, None)
+    if loaded is not None and loaded[0] == previous_signature:
+        existing_requested_services = loaded[1]
+        existing_requested_services.update(new_requested_services)
+        _dump_cache_file(output_path + EXISTING_CACHE_SUFFIX, signature,
+                         existing_requested_services)
+
+
 def discard_existing_services(services_to_request, output_path):
     """
     Discards the train services to request for which there is already existing
@@ -29,18 +277,17 @@ def discard_existing_services(services_to_request, output_path):
         argument, but only including those train services to request that are
         not already in the output file.
     """
-    existing_requested_services = set()
-    for line in DictReader(open(output_path, 'r'), delimiter='|'):
-        o_station = line['origin_station']
-        d_station = line['destination_station']
-        t_date = line['travel_date']
-        s_date = line['search_date']
-        existing_requested_services.add((o_station, d_station, t_date, s_date))
-
-    remaining_services_to_request = []
-    for ser in services_to_request:
-        if ser not in existing_requested_services:
-            remaining_services_to_request.append(ser)
+    # First check the services against the bloom filter, so that the whole set
+    # of existing services is only loaded if some of them may exist:
+    bloom = _load_cache_file(output_path + BLOOM_CACHE_SUFFIX, output_path)
+    if bloom is not None and not any(bloom_contains(bloom, ser)
+                                     for ser in services_to_request):
+        return list(services_to_request)
+
+    existing_requested_services = _load_cached_existing(output_path)
+
+    remaining_services_to_request = list(filterfalse(
+        existing_requested_services.__contains__, services_to_request))
     return remaining_services_to_request
 
 
@@ -71,14 +318,10 @@ def load_services_to_request(station_ods, travel_dates, search_date,
         date combinations that have been specified, but all the existing ones
         in the output file are not here.
     """
-    services_to_request = []
-
-    for o_s, d_s in station_ods:
-        for t_d in travel_dates:
-            services_to_request.append((o_s, d_s, t_d, search_date))
+    services_to_request = [(o_s, d_s, t_d, search_date) for (o_s, d_s), t_d
+                           in product(station_ods, travel_dates)]
 
-    print('{}\tTotal specified requests: {}'
-          .format(datetime.now(), len(services_to_request)))
+    logger.info('Total specified requests: %s', len(services_to_request))
 
     # If some train services already exist in the output file and
     # repeat_services is set as False, skip them:
@@ -93,7 +336,7 @@ def load_services_to_request(station_ods, travel_dates, search_date,
         initialize_output_file(output_path)
         remaining_services_to_request = services_to_request
 
-    print('{}\tSpecified requests pending: {}'
-          .format(datetime.now(), len(remaining_services_to_request)))
+    logger.info('Specified requests pending: %s',
+                len(remaining_services_to_request))
 
     return remaining_services_to_request
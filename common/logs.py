@@ -0,0 +1,31 @@
+import logging
+from logging.handlers import MemoryHandler
+import sys
+
+
+# Handler buffering the log records of the scrapers, once configured:
+_handler = None
+
+
+def configure_logging(capacity=100):
+    """
+    Configures the logging of the scrapers, so that log records are written in
+    the standard output preceded by their date and time. Records are buffered
+    and written in blocks of "capacity" records (or as soon as an error is
+    logged), instead of writing each one of them separately. This function
+    can be called several times, the logging is only configured once.
+    :param capacity: (integer) number of records buffered before writing them.
+    :return: handler: (MemoryHandler) handler buffering the log records, which
+        can be flushed to write the buffered records.
+    """
+    global _handler
+    if _handler is None:
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(logging.Formatter(
+            '%(asctime)s.%(msecs)03d\t%(message)s', '%Y-%m-%d %H:%M:%S'))
+        _handler = MemoryHandler(capacity, flushLevel=logging.ERROR,
+                                 target=stream_handler)
+        root_logger = logging.getLogger()
+        root_logger.addHandler(_handler)
+        root_logger.setLevel(logging.INFO)
+    return _handler
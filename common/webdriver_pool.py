@@ -0,0 +1,181 @@
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
+from selenium.common.exceptions import WebDriverException
+from urllib3.exceptions import HTTPError
+from queue import Queue, Empty
+from os import makedirs
+from os.path import join
+from functools import partial
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# Resources that are never read by the scrapers (images, fonts and trackers),
+# which are blocked so that the browser does not request them:
+BLOCKED_URL_PATTERNS = ['*.png', '*.jpg', '*.gif', '*.woff*',
+                        '*googletagmanager*', '*google-analytics*',
+                        '*doubleclick*', '*facebook*', '*hotjar*']
+
+# Errors raised when the connection with chromedriver is lost (for example,
+# "MaxRetryError" if it has died), which mean that the webdriver is dead:
+CONNECTION_ERRORS = (HTTPError, ConnectionError)
+
+
+def init_webdriver(chromedriver_path, headless=True,
+                   page_load_strategy='normal', profile_dir=None):
+    """
+    Initialises a Chrome Webdriver.
+    :param chromedriver_path: (string) path to the chromedriver exe file.
+    :param headless: (boolean) if False, the browser window will be shown. Set
+        as True for speed.
+    :param page_load_strategy: (string) 'normal' to wait for the whole page
+        (images, stylesheets...) to load when retrieving a website, or 'eager'
+        to only wait for the HTML document to be parsed. Use 'eager' only if
+        the required page elements are explicitly waited for afterwards.
+    :param profile_dir: (string) path to the directory where the Chrome
+        profile is kept between runs, so that the browser cache is reused. If
+        None, a new empty profile is used.
+    :return driver: (Chrome Webdriver) initialised webdriver.
+    """
+    capabilities = DesiredCapabilities.CHROME.copy()
+    capabilities['pageLoadStrategy'] = page_load_strategy
+    options = Options()
+    if headless:
+        options.add_argument("--headless")  # to not see browser window
+        options.add_argument("--disable-gpu")
+    # images are never read, so do not load them:
+    options.add_argument("--blink-settings=imagesEnabled=false")
+    options.add_experimental_option(
+        "prefs", {"profile.managed_default_content_settings.images": 2})
+    if profile_dir is not None:
+        makedirs(profile_dir, exist_ok=True)
+        options.add_argument("--user-data-dir={}".format(profile_dir))
+        options.add_argument("--disk-cache-size=104857600")  # 100 MB
+    driver = webdriver.Chrome(chromedriver_path, options=options,
+                              desired_capabilities=capabilities)
+    driver.execute_cdp_cmd('Network.enable', {})
+    driver.execute_cdp_cmd('Network.setBlockedURLs',
+                           {'urls': BLOCKED_URL_PATTERNS})
+    return driver
+
+
+def init_webdriver_pool(chromedriver_path, pool_size, headless=True,
+                        page_load_strategy='normal', profile_dir=None):
+    """
+    Initialises a set of Chrome Webdrivers that will be shared by the threads
+    requesting the train services, so that each browser is launched only once
+    and then reused for all the requests.
+    :param chromedriver_path: (string) path to the chromedriver exe file.
+    :param pool_size: (integer) number of webdrivers to initialise.
+    :param headless: (boolean) if False, the browser windows will be shown. Set
+        as True for speed.
+    :param page_load_strategy: (string) see "init_webdriver".
+    :param profile_dir: (string) path to the directory where the Chrome
+        profiles (one per webdriver) are kept between runs, so that the
+        browser cache is reused. If None, new empty profiles are used.
+    :return drivers: (Queue of tuples (function, Chrome Webdriver)) initialised
+        webdrivers that are available to be used, each one of them together
+        with the function that initialises it again if it stops working.
+    """
+    drivers = Queue()
+    for driver_index in range(pool_size):
+        # each browser needs its own profile, as Chrome locks it:
+        driver_profile_dir = None if profile_dir is None else \
+            join(profile_dir, 'driver_{}'.format(driver_index))
+        driver_factory = partial(init_webdriver, chromedriver_path,
+                                 headless=headless,
+                                 page_load_strategy=page_load_strategy,
+                                 profile_dir=driver_profile_dir)
+        drivers.put((driver_factory, driver_factory()))
+    return drivers
+
+
+def quit_webdriver_pool(drivers):
+    """
+    Closes all the webdrivers available in the pool.
+    :param drivers: (Queue of tuples (function, Chrome Webdriver)) initialised
+        webdrivers.
+    """
+    while True:
+        try:
+            _, driver = drivers.get_nowait()
+        except Empty:
+            break
+        if driver is not None:
+            driver.quit()
+
+
+def _webdriver_alive(driver):
+    """
+    Checks whether a webdriver still responds, so that it is only replaced
+    when it has really stopped working.
+    :param driver: (Chrome Webdriver) webdriver to check.
+    :return: (boolean) True if the webdriver responds, False otherwise.
+    """
+    try:
+        driver.current_url
+    except (WebDriverException,) + CONNECTION_ERRORS:
+        return False
+    return True
+
+
+def _reinit_webdriver(driver_factory):
+    """
+    Initialises again a webdriver of the pool that has stopped working.
+    :param driver_factory: (function) function that initialises the webdriver.
+    :return driver: (Chrome Webdriver) initialised webdriver, or None if it
+        could not be initialised (for example, if Chrome does not start).
+    """
+    try:
+        return driver_factory()
+    except Exception as error:
+        logger.info('Webdriver could not be initialised again (%s).', error)
+        return None
+
+
+def request_with_pooled_webdriver(drivers, request_function, *args, **kwargs):
+    """
+    Takes a webdriver from the pool (waiting until one is available), launches
+    the request function with it and puts it back in the pool afterwards. If
+    the request function raises a "WebDriverException" type exception, False
+    is returned, and the webdriver is replaced by a new one if it has stopped
+    working (it does not respond any more, or the connection with it has been
+    lost). If the new webdriver cannot be initialised, it is put
+    back in the pool as None, and it is initialised again the next time it is
+    taken (returning False if it fails again).
+    :param drivers: (Queue of tuples (function, Chrome Webdriver)) initialised
+        webdrivers (None for those that could not be initialised again).
+    :param request_function: (function) function to launch, which must take
+        the webdriver as first argument.
+    :param args: positional arguments passed to the request function after the
+        webdriver.
+    :param kwargs: keyword arguments passed to the request function.
+    :return: the value returned by the request function, or False if it has
+        raised a webdriver error.
+    """
+    driver_factory, driver = drivers.get()
+    try:
+        if driver is None:
+            driver = _reinit_webdriver(driver_factory)
+            if driver is None:
+                return False
+        return request_function(driver, *args, **kwargs)
+    except (WebDriverException,) + CONNECTION_ERRORS as error:
+        # page errors (stale elements, intercepted clicks...) do not need a
+        # new webdriver:
+        if isinstance(error, WebDriverException) and _webdriver_alive(driver):
+            logger.info('Webdriver error (%s). The request will be retried.',
+                        error.msg)
+            return False
+        logger.info('Webdriver stopped working (%s). Initialising it again.',
+                    error)
+        try:
+            driver.quit()
+        except (WebDriverException,) + CONNECTION_ERRORS:
+            pass
+        driver = _reinit_webdriver(driver_factory)
+        return False
+    finally:
+        drivers.put((driver_factory, driver))
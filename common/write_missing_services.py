@@ -13,9 +13,11 @@ def write_missing_services(missing_services, operator, output_dir):
         'missing_services.txt' file will be generated.
     """
     output_path = join(output_dir, 'missing_services.txt')
-    with open(output_path, 'w') as output_file:
+    # the operator is the same for all the services:
+    operator_field = f'|{operator}|'
+    lines = [f'{o_station}|{d_station}{operator_field}{t_date}\n'
+             for o_station, d_station, t_date, _ in missing_services]
+    with open(output_path, 'w', buffering=1 << 20) as output_file:
         output_file.write(
             'origin_station|destination_station|operator|travel_date\n')
-        for o_station, d_station, t_date, _ in missing_services:
-            output_file.write('{}|{}|{}|{}\n'.format(o_station, d_station,
-                                                     operator, t_date))
+        output_file.writelines(lines)
@@ -1,136 +1,202 @@
 import configparser
-from common.dates import load_dates_inbetween, add_days_to_date
-from csv import DictReader
+import heapq
+from common.dates import load_dates_inbetween
+from sys import intern
 
 
-def load_trains(input_path, origin_station, destination_station, travel_dates):
+# Translation table converting a price string ("12,50€") to a float string:
+_PRICE_TRANS = str.maketrans({',': '.', '€': None})
+
+
+def load_trains_bidirectional(input_path, a_station, b_station,
+                              date_positions):
     """
-    Given an origin station, a destination station and a set of travel dates,
-    this function loads the train services that match these characteristics
-    from an input file, skipping those with non-numerical price values.
+    Loads the train services between two stations, in both directions, within
+    a set of travel dates from an input file, skipping those with
+    non-numerical price values. The input file is read only once.
     :param input_path: (str) path to the input file.
-    :param origin_station: (str)
-    :param destination_station: (str)
-    :param travel_dates: ([str,str,str,...]) DD/MM/YYYY
-    :return trains: ({str->[((str,str),float,str,str)]}) dictionary relating
-        each travel date (string DD/MM/YYYY) to a list in which each element is
-        a tuple representing a train service departing that date. The elements
-        of each tuple are:
+    :param a_station: (str) origin station of the go trains, and destination
+        station of the return trains.
+    :param b_station: (str) destination station of the go trains, and origin
+        station of the return trains.
+    :param date_positions: ({str->int}) dictionary relating each travel date
+        (string DD/MM/YYYY) to its position in the travel dates.
+    :return go_trains, return_trains: ([[((str,str),float,str,str)]],
+        [[((str,str),float,str,str)]]) lists of the go trains (from a_station
+        to b_station) and of the return trains (from b_station to a_station).
+        Each element of these lists is, for the travel date in that position,
+        a list in which each element is a tuple representing a train service
+        departing that date. The elements of each tuple are:
         1) Another tuple, of two elements, with the departure and arrival times.
         2) A float value indicating the train price.
         3) A string indicating the operator of this train.
         4) A string indicating the departure date of the train (DD/MM/YYYY).
     """
-    trains = {}
-
-    for line in DictReader(open(input_path, 'r'), delimiter='|'):
-
-        # Discard trains that do not match the specified conditions:
-        if line['origin_station'] != origin_station:
-            continue
-        if line['destination_station'] != destination_station:
-            continue
-        travel_date = line['travel_date']
-        if travel_date not in travel_dates:
-            continue
-
-        # Load price as float. If not numerical value, skip:
-        try:
-            price = float(line['price'].replace(',', '.').replace('€', ''))
-        except ValueError:
-            continue
+    go_trains = [[] for _ in date_positions]
+    return_trains = [[] for _ in date_positions]
+    go_od = (a_station, b_station)
+    return_od = (b_station, a_station)
+
+    # The file is read in large blocks, to reduce the number of reads:
+    with open(input_path, 'r', buffering=1 << 20) as input_file:
+        header = next(input_file).rstrip('\n').split('|')
+        i_o = header.index('origin_station')
+        i_d = header.index('destination_station')
+        i_td = header.index('travel_date')
+        i_p = header.index('price')
+        i_dt = header.index('departure_time')
+        i_at = header.index('arrival_time')
+        i_c = header.index('company')
+
+        # If the origin station is the first column, the lines of trains that
+        # do not depart from any of both stations are discarded before being
+        # split:
+        prefixes = (a_station + '|', b_station + '|') if i_o == 0 else ('',)
+
+        for raw_line in input_file:
+            if not raw_line.startswith(prefixes):
+                continue
+            line = raw_line.rstrip('\n').split('|')
+
+            # Discard trains that do not match the specified conditions:
+            od = (line[i_o], line[i_d])
+            if od == go_od:
+                trains = go_trains
+            elif od == return_od:
+                trains = return_trains
+            else:
+                continue
+            travel_date = line[i_td]
+            date_position = date_positions.get(travel_date)
+            if date_position is None:
+                continue
+            # the same dates, times and companies are repeated in many train
+            # services, so a single string object is kept for each value:
+            travel_date = intern(travel_date)
+
+            # Load price as float. If not numerical value, skip:
+            try:
+                price = float(line[i_p].translate(_PRICE_TRANS))
+            except ValueError:
+                continue
 
-        # Add train information to trains dictionary
-        if travel_date not in trains:
-            trains[travel_date] = []
-        train_times = (line['departure_time'], line['arrival_time'])
-        trains[travel_date].append((train_times, price,
-                                    line['company'], travel_date))
+            # Add train information to trains list
+            train_times = (intern(line[i_dt]), intern(line[i_at]))
+            trains[date_position].append((train_times, price, intern(line[i_c]),
+                                        travel_date))
 
-    return trains
+    return go_trains, return_trains
 
 
-def possible_train_combinations(available_go_trains, available_return_trains,
-                                travel_dates, trip_days):
+def flatten_trains(available_trains):
     """
-    Selects the possible combinations between go trains and return trains, where
-    both trains must be during the travel dates, and there must be a number
-    of days between the go train and the return train that is included in the
-    trip_days list.
-    :param available_go_trains: ({str->[((str,str),float,str,str)]}) dictionary
-        relating each travel date (string DD/MM/YYYY) to a list in which each
-        element is a tuple representing a GO train service departing that date.
-        The elements of each tuple are:
-        1) Another tuple, of two elements, with the departure and arrival times.
-        2) A float value indicating the train price.
-        3) A string indicating the operator of this train.
-        4) A string indicating the departure date of the train (DD/MM/YYYY).
-    :param available_return_trains: ({str->[((str,str),float,str,str)]}) same
-        to available_go_trains, but containing return trains instead.
-    :param travel_dates: ([str,str,str,...]) DD/MM/YYYY
+    Flattens the train services of all travel dates into a list of train
+    services and a list of their prices, both sorted by travel date, so that
+    each train service is referred to by its position in these lists.
+    Repeated train services of the same date are kept only once.
+    :param available_trains: ([[((str,str),float,str,str)]]) train services of
+        each travel date, as returned (for each direction) by the
+        "load_trains_bidirectional" function.
+    :return records, prices, date_ranges: ([((str,str),float,str,str)],
+        [float], [(int,int)]) train services, their prices, and, for each
+        travel date (in the same order as available_trains), the start and end
+        positions of the train services departing that date in records and
+        prices.
+    """
+    records = []
+    date_ranges = []
+    for date_trains in available_trains:
+        start = len(records)
+        # repeated train services would repeat combinations:
+        records.extend(dict.fromkeys(date_trains))
+        date_ranges.append((start, len(records)))
+    prices = [record[1] for record in records]
+    return records, prices, date_ranges
+
+
+def iter_combinations(go_prices, go_date_ranges, return_prices,
+                      return_date_ranges, trip_days):
+    """
+    Generates the possible combinations between go trains and return trains,
+    where both trains must be during the travel dates, and there must be a
+    number of days between the go train and the return train that is included
+    in the trip_days list. Each combination is generated only once.
+    :param go_prices: ([float]) prices of the GO train services, as returned
+        by the "flatten_trains" function.
+    :param go_date_ranges: ([(int,int)]) positions of the GO train services of
+        each travel date, as returned by the "flatten_trains" function.
+    :param return_prices: ([float]) same to go_prices, but for return trains.
+    :param return_date_ranges: ([(int,int)]) same to go_date_ranges, but for
+        return trains.
     :param trip_days: ([int])
-    :return combinations: {(go_train, return_train): float} relates each pair
-        of possible go and return trains with the total price of both.
+    :return: generator of tuples (float, int, int), each one of them relating
+        the total price of a pair of possible go and return trains with the
+        positions of both trains.
     """
-    # Extract possible go-return train combinations between available go trains
-    # and available return trains:
-    combinations = {}
+    # repeated trip days would repeat combinations:
+    trip_days = list(dict.fromkeys(trip_days))
+
+    # as travel dates are consecutive, the return date of each trip is found
+    # by adding the trip days to the position of the go date:
+    num_dates = len(go_date_ranges)
 
     # for each possible go date:
-    for go_date in travel_dates:
-        if go_date not in available_go_trains:  # avoid KeyError
+    for go_i, (go_start, go_end) in enumerate(go_date_ranges):
+        if go_start == go_end:  # no train services that date
             continue
-        # reach potential trains for go date:
-        go_trains = available_go_trains[go_date]
 
         # for each value of trip number of days, obtain a return date:
         for t_day in trip_days:
-            return_date = add_days_to_date(go_date, t_day)
+            return_i = go_i + t_day
 
-            # if the return date is outside travel dates or there are no train
-            # services that date, skip:
-            if return_date not in travel_dates:
-                continue
-            if return_date not in available_return_trains:  # avoid KeyError
+            # if the return date is outside travel dates, skip:
+            if not 0 <= return_i < num_dates:
                 continue
+            return_positions = range(*return_date_ranges[return_i])
 
-            # reach potential trains for return date:
-            return_trains = available_return_trains[return_date]
-
-            # now we have a set of go dates and a set of return dates,
-            # iterate over them to generate all combinations:
-            for go_train in go_trains:
-                for return_train in return_trains:
-                    total_price = go_train[1] + return_train[1]
-                    combinations[(go_train, return_train)] = total_price
-
-    return combinations
+            # iterate over the go and return trains to generate all
+            # combinations:
+            for go_position in range(go_start, go_end):
+                go_price = go_prices[go_position]
+                for return_position in return_positions:
+                    yield (go_price + return_prices[return_position],
+                           go_position, return_position)
 
 
 def select_cheapest(combinations, min_i):
     """
     Select the cheapest N combinations, where N = min_i, and all those
-    combinations at least as cheap as those N cheapest.
-    :param combinations: {(go_train, return_train): float} relates each pair
-        of possible go and return trains with the total price of both.
+    combinations as cheap as the N-th cheapest one. The combinations are
+    consumed one by one, keeping only the cheapest ones in memory.
+    :param combinations: (iterable of tuples (float, int, int)) total price and
+        positions of each pair of possible go and return trains (see
+        "iter_combinations").
     :param min_i: (int) minimum number of combinations to return.
-    :return cheapest_combinations: same data structure as combinations argument,
-        but keeping only the cheapest options.
+    :return cheapest_combinations: ([(float, int, int)]) cheapest combinations,
+        sorted by price (ties in generation order).
     """
-    cheapest_combinations = {}
-    max_price = float('inf')
-    i = 0
-    for combi, price in sorted(combinations.items(), key=lambda item: item[1]):
-
-        if i == min_i:
-            max_price = price
-
-        if price > max_price:
-            break
-
-        cheapest_combinations[combi] = price
-
-    return cheapest_combinations
+    # max-heap (prices and generation order negated) of the min_i cheapest
+    # combinations, and combinations tied with the min_i-th cheapest one:
+    heap = []
+    ties = []
+    for seq, (price, go_position, return_position) in enumerate(combinations):
+        if len(heap) < min_i:
+            heapq.heappush(heap, (-price, -seq, go_position, return_position))
+            continue
+        kth_price = -heap[0][0]
+        if price < kth_price:
+            dropped = heapq.heapreplace(
+                heap, (-price, -seq, go_position, return_position))
+            if -heap[0][0] == kth_price:
+                ties.append(dropped)
+            else:
+                ties = []
+        elif price == kth_price:
+            ties.append((-price, -seq, go_position, return_position))
+
+    return [(-neg_price, go_position, return_position)
+            for neg_price, _, go_position, return_position
+            in sorted(heap + ties, key=lambda item: (-item[0], -item[1]))]
 
 
 def main_function(config_file_path):
@@ -144,53 +210,49 @@ def main_function(config_file_path):
     parser = configparser.ConfigParser()
     parser.read(config_file_path)
 
-    origin_station = parser.get("config", "origin_station")
-    destination_station = parser.get("config", "destination_station")
-    trip_days = [int(d) for d in parser.get("config", "trip_days").split(',')]
+    config = parser["config"]
+
+    origin_station = config["origin_station"]
+    destination_station = config["destination_station"]
+    trip_days = [int(d) for d in config["trip_days"].split(',')]
     travel_dates = \
-        load_dates_inbetween(*parser.get("config",
-                                         "travel_date_boundaries").split('-'))
-    train_services_info_file_path = \
-        parser.get("config", "train_services_info_file_path")
-    output_path = parser.get("config", "output_path")
-
-    # Load available "go" trains within the specified travel dates:
-    available_go_trains = \
-        load_trains(train_services_info_file_path,
-                    origin_station, destination_station, travel_dates)
-
-    # Load available "return" trains within the specified travel dates:
-    available_return_trains = \
-        load_trains(train_services_info_file_path,
-                    destination_station, origin_station, travel_dates)
-
-    # Extract possible go-return train combinations between available go trains
-    # and available return trains:
-    combinations = possible_train_combinations(available_go_trains,
-                                               available_return_trains,
-                                               travel_dates, trip_days)
-
-    # Filter only cheapest combinations:
-    cheapest_combinations = select_cheapest(combinations, 50)
-
-    # Write the cheapest combinations in output file:
-    i = 0
-    with open(output_path, 'w') as output_file:
-        for combi, price in cheapest_combinations.items():
-
-            output_file.write('{}|{}€|'.format(i, price) +
-                              '{}|{}€|{}|{}|{}|'
-                              .format(combi[0][2], combi[0][1],
-                                      combi[0][0][0], combi[0][3],
-                                      origin_station) +
-                              '{}|{}|'
-                              .format(combi[0][0][1], destination_station) +
-                              '|{}|{}€|{}|{}|{}\n'
-                              .format(combi[1][2], combi[1][1],
-                                      combi[1][0][0], combi[1][3],
-                                      destination_station))
-
-            i += 1
+        load_dates_inbetween(*config["travel_date_boundaries"].split('-'))
+    # position of each travel date, to check whether a date is a travel date
+    # and to group the trains by date:
+    date_positions = {travel_date: date_position
+                      for date_position, travel_date in enumerate(travel_dates)}
+    train_services_info_file_path = config["train_services_info_file_path"]
+    output_path = config["output_path"]
+
+    # Load available "go" and "return" trains within the specified travel
+    # dates (reading the input file only once):
+    available_go_trains, available_return_trains = \
+        load_trains_bidirectional(train_services_info_file_path,
+                                  origin_station, destination_station,
+                                  date_positions)
+
+    # Generate possible go-return train combinations between available go
+    # trains and available return trains, and keep only cheapest combinations:
+    go_records, go_prices, go_date_ranges = \
+        flatten_trains(available_go_trains)
+    return_records, return_prices, return_date_ranges = \
+        flatten_trains(available_return_trains)
+    combinations = iter_combinations(go_prices, go_date_ranges,
+                                     return_prices, return_date_ranges,
+                                     trip_days)
+    cheapest_combinations = {
+        (go_records[go_position], return_records[return_position]): price
+        for price, go_position, return_position
+        in select_cheapest(combinations, 50)}
+
+    # Write the cheapest combinations in output file (all lines at once):
+    lines = [f'{i}|{price}€|{go[2]}|{go[1]}€|{go[0][0]}|{go[3]}|'
+             f'{origin_station}|{go[0][1]}|{destination_station}|'
+             f'|{ret[2]}|{ret[1]}€|{ret[0][0]}|{ret[3]}|{destination_station}\n'
+             for i, ((go, ret), price)
+             in enumerate(cheapest_combinations.items())]
+    with open(output_path, 'w', buffering=1 << 20) as output_file:
+        output_file.writelines(lines)
 
 
 if __name__ == '__main__':